@@ -1,14 +1,10 @@
 import os
 import sys
-import git
-import time
 import click
-import datetime
-import itertools
 from pathlib import Path
-from collections import defaultdict
 from derivedrepo import DerivedGitRepo, Logger
-from derivedrepo.utils import clear_directory
+from derivedrepo.sets import DEFAULT_DERIVATION
+from derivedrepo.utils import clear_directory, run_git
 
 def safe_cli():
     try: cli()
@@ -33,19 +29,19 @@ def init(source):
         print("Could not initialize:", str(e))
 
 class NewSetLogger(Logger):
-    def log_derive_start(self, commit):
-        print("  Derive Start:", commit)
+    def log_derive_start(self, commit, derivation=DEFAULT_DERIVATION):
+        print(f"  Derive Start ({derivation}):", commit)
 
-    def log_derive_finished(self, commit, output_dir, notes):
-        print("  Finished. Output at", output_dir)
+    def log_derive_finished(self, commit, output_dir, notes, derivation=DEFAULT_DERIVATION):
+        print(f"  Finished ({derivation}). Output at", output_dir)
         print("  Notes:", notes)
 
-    def log_derive_failed(self, commit, notes):
-        print("  Failed.")
+    def log_derive_failed(self, commit, notes, derivation=DEFAULT_DERIVATION):
+        print(f"  Failed ({derivation}).")
         print("  Notes:", notes)
 
-    def log_derivative_stored(self, commit):
-        print("  Stored.")
+    def log_derivative_stored(self, commit, derivation=DEFAULT_DERIVATION):
+        print(f"  Stored ({derivation}).")
 
 
 @cli.group(name="set")
@@ -89,48 +85,138 @@ def set_new_latest():
 @click.option("--branch", required=True)
 @click.option("--name", required=True)
 @click.option("--split", type=click.Choice(["", "days"]), default="")
-def set_new_latest_days(days, branch, name, split):
+@click.option("--sample", type=click.Choice(["all", "nth", "day", "tag", "merges", "exponential"]), default="all")
+@click.option("--every", type=click.IntRange(1), default=10, help="Step size for --sample nth.")
+@click.option("--base", type=click.FloatRange(1, min_open=True), default=2.0, help="Growth factor for --sample exponential.")
+def set_new_latest_days(days, branch, name, split, sample, every, base):
+    import time
+    import datetime
+    from derivedrepo import sampling
+
     drepo = get_drepo()
     src_repo = drepo.get_source_repo()
 
-    stop = time.time() - datetime.timedelta(days=days).total_seconds()
-    all_commits = []
-
-    for commit in src_repo.iter_commits(branch):
-        if commit.committed_datetime.timestamp() < stop:
-            break
-        all_commits.append(commit)
+    since = time.time() - datetime.timedelta(days=days).total_seconds()
+    all_commits = sampling.list_commits(src_repo, branch, since=since, merges_only=(sample == "merges"))
 
-    all_commits = list(reversed(all_commits))
+    if sample == "nth":
+        all_commits = sampling.sample_every_nth(all_commits, every)
+    elif sample == "day":
+        all_commits = sampling.sample_per_day(all_commits)
+    elif sample == "tag":
+        all_commits = sampling.sample_tagged(all_commits, sampling.get_tagged_hexshas(src_repo))
+    elif sample == "exponential":
+        all_commits = sampling.sample_exponential(all_commits, base)
 
     if split == "":
-        drepo.new_set(name, all_commits, NewSetLogger())
+        drepo.new_set(name, [commit.hexsha for commit in all_commits], NewSetLogger())
     elif split == "days":
-        commits_per_days = defaultdict(list)
-        for commit in all_commits:
-            date = str(commit.committed_datetime.date())
-            commits_per_days[date].append(commit)
-        for date, commits in commits_per_days.items():
-            drepo.new_set(name + date, commits, NewSetLogger())
+        for date, commits in sampling.group_by_day(all_commits).items():
+            drepo.new_set(name + date, [commit.hexsha for commit in commits], NewSetLogger())
 
 @set_new_latest.command(name="commits")
 @click.argument("amount", type=click.IntRange(0))
 @click.option("--branch", required=True)
 @click.option("--name", required=True)
 def set_new_latest_commits(amount, branch, name):
+    from derivedrepo import sampling
+
+    drepo = get_drepo()
+    src_repo = drepo.get_source_repo()
+    commits = sampling.list_commits(src_repo, branch, max_count=amount)
+    drepo.new_set(name, [commit.hexsha for commit in commits], NewSetLogger())
+
+@set_new.command(name="between")
+@click.argument("old")
+@click.argument("new")
+@click.option("--name", required=True)
+@click.option("--count", type=click.IntRange(1), default=5, help="Number of commits to add between OLD and NEW.")
+@click.option("--derivation", "derivations", multiple=True,
+              help="Derivation to build, can be repeated. Defaults to all derivations in derive.py.")
+def set_new_between(old, new, name, count, derivations):
+    from derivedrepo import sampling
+
     drepo = get_drepo()
     src_repo = drepo.get_source_repo()
-    commits = list(itertools.islice(src_repo.iter_commits(branch), amount))
-    drepo.new_set(name, list(reversed(commits)), NewSetLogger())
+    derivations = list(derivations) or drepo.get_derivation_names()
+    # Commits are only skipped when every derivation to build has them already.
+    commits = [commit for commit in sampling.list_commits_between(src_repo, old, new)
+               if not all(drepo.has_derived_commit(commit.hexsha, derivation=derivation)
+                          for derivation in derivations)]
+    commits = sampling.sample_evenly(commits, count)
+    if not commits:
+        print("No underived commits between", old, "and", new)
+        return
+    drepo.new_set(name, [commit.hexsha for commit in commits], NewSetLogger(), derivations=derivations)
 
 
 @cli.command()
 @click.argument("id")
-def checkout(id):
+@click.option("--derivation", default=DEFAULT_DERIVATION)
+@click.option("--derive-on-miss", is_flag=True,
+              help="Derive the commit into the on-demand set if no set has it. "
+                   "This checks out that commit in the source repository, uncommitted changes "
+                   "there are stashed with `git stash push` and are not popped afterwards.")
+def checkout(id, derivation, derive_on_miss):
     drepo = get_drepo()
-    src_repo = drepo.get_source_repo()
-    commit = src_repo.commit(id)
-    drepo.checkout(commit.hexsha)
+    drepo.checkout(resolve_hexsha(drepo, id), derivation=derivation,
+                   derive_on_miss=derive_on_miss, logger=NewSetLogger())
+
+@cli.command()
+@click.argument("old")
+@click.argument("new")
+@click.option("--derivation", default=DEFAULT_DERIVATION)
+@click.option("--json", "as_json", is_flag=True, help="Print the diff as JSON.")
+def diff(old, new, derivation, as_json):
+    drepo = get_drepo()
+    tree_diff = drepo.diff(resolve_hexsha(drepo, old), resolve_hexsha(drepo, new), derivation)
+    if as_json:
+        print_json(tree_diff.to_json())
+    else:
+        print_tree_diff(tree_diff)
+
+@cli.command(name="diff-series")
+@click.argument("set_name")
+@click.option("--json", "as_json", is_flag=True, help="Print the diffs as JSON.")
+def diff_series(set_name, as_json):
+    drepo = get_drepo()
+    tree_diffs = drepo.diff_series(set_name)
+    if as_json:
+        print_json([tree_diff.to_json() for tree_diff in tree_diffs])
+    else:
+        for tree_diff in tree_diffs:
+            print_tree_diff(tree_diff)
+
+def print_tree_diff(tree_diff):
+    print(f"{tree_diff.old_hexsha[:7]}..{tree_diff.new_hexsha[:7]}: {tree_diff.size_delta:+} bytes")
+    for change in tree_diff.changes:
+        print(f"  {change.size_delta:+10}  {change.status:8}  {change.path}")
+
+def print_json(data):
+    import json
+    print(json.dumps(data, indent=4))
+
+@cli.command()
+@click.option("--repair", is_flag=True, help="Repair damaged local sets from healthy remote copies.")
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON.")
+def verify(repair, as_json):
+    drepo = get_drepo()
+    results = drepo.verify(repair=repair)
+    if as_json:
+        print_json([result.to_json() for result in results])
+    else:
+        for result in results:
+            kind = "Local" if result.is_local else "Remote"
+            status = "OK" if result.ok else "DAMAGED"
+            if result.repaired:
+                status += " (repaired)"
+            print(f"{kind}: {result.identifier}: {status}")
+            for problem in result.problems:
+                print("  " + problem)
+            for warning in result.warnings:
+                print("  Warning: " + warning)
+    if not all(result.ok for result in results):
+        sys.exit(1)
 
 def abort_if_false(ctx, param, value):
     if not value:
@@ -194,5 +280,14 @@ def remote_rm(path):
 def get_drepo() -> DerivedGitRepo:
     return DerivedGitRepo(os.getcwd())
 
+def resolve_hexsha(drepo: DerivedGitRepo, id: str) -> str:
+    # Full hexshas are used as-is, so that the source repo does not have to be opened.
+    if len(id) == 40 and all(c in "0123456789abcdef" for c in id):
+        return id
+    result = run_git(drepo.source_path, "rev-parse", "--verify", "--quiet", id + "^{commit}")
+    if result.returncode != 0:
+        raise Exception("cannot resolve commit: " + id)
+    return result.stdout.decode().strip()
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -1,2 +1,9 @@
 from . derived_git_repo import DerivedGitRepo
-from . logger import Logger
\ No newline at end of file
+from . logger import Logger
+
+def __getattr__(name):
+    # Imported on demand, so that the CLI does not pay for asyncio.
+    if name == "AsyncDerivedGitRepo":
+        from . async_derived_git_repo import AsyncDerivedGitRepo
+        return AsyncDerivedGitRepo
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,140 @@
+import os
+import shutil
+import asyncio
+
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from . derived_git_repo import DerivedGitRepo
+from . sets import LocalSet, RemoteFolderSet, DEFAULT_DERIVATION, get_tag_name
+
+from . utils import (
+    clear_directory,
+    ensure_dir_exists,
+)
+
+
+class AsyncDerivedGitRepo:
+    drepo: DerivedGitRepo
+    max_extractions: int
+
+    def __init__(self, local_dir: Union[PathLike, DerivedGitRepo], *, max_extractions: int = 4):
+        if isinstance(local_dir, DerivedGitRepo):
+            self.drepo = local_dir
+        else:
+            self.drepo = DerivedGitRepo(local_dir)
+        self.max_extractions = max_extractions
+
+        self._extraction_semaphore = asyncio.Semaphore(max_extractions)
+        self._directory_locks: Dict[Path, asyncio.Lock] = dict()
+        self._pending_lookups: Dict[Tuple[str, bool], asyncio.Task] = dict()
+        self._pending_downloads: Dict[Path, asyncio.Task] = dict()
+        self._pending_checkouts: Dict[Tuple[str, Path], asyncio.Task] = dict()
+        self._pending_derivations: Dict[str, asyncio.Task] = dict()
+
+    async def find_set(self, hexsha: str, check_remotes: bool = True,
+            derivation: str = DEFAULT_DERIVATION) -> Optional[LocalSet]:
+        return await self._find_set_with_tag(get_tag_name(hexsha, derivation), check_remotes)
+
+    async def download(self, remote_set: RemoteFolderSet) -> LocalSet:
+        dst = self.drepo.local_sets_dir / remote_set.get_name()
+        return await self._deduplicate(
+            self._pending_downloads, dst,
+            lambda: self._download(remote_set, dst))
+
+    async def checkout(self, hexsha: str, directory: Optional[PathLike] = None,
+            derivation: str = DEFAULT_DERIVATION, derive_on_miss: bool = False) -> Path:
+        checkout_dir = self.drepo.default_checkout_dir if directory is None else Path(directory)
+        tag_name = get_tag_name(hexsha, derivation)
+        return await self._deduplicate(
+            self._pending_checkouts, (tag_name, checkout_dir),
+            lambda: self._checkout(hexsha, derivation, checkout_dir, derive_on_miss))
+
+    async def open_file(self, hexsha: str, path: str, derivation: str = DEFAULT_DERIVATION) -> bytes:
+        local_set = await self.find_set(hexsha, derivation=derivation)
+        if local_set is None:
+            raise Exception("cannot find a derived version of that commit")
+        if not await asyncio.to_thread(local_set.is_valid, hexsha, derivation):
+            raise Exception("the derivation of that commit failed")
+        tag_name = get_tag_name(hexsha, derivation)
+        return await run_git(local_set.path, "cat-file", "blob", f"refs/tags/{tag_name}:{path}")
+
+    # Implementation
+    ##########################################
+
+    async def _find_set_with_tag(self, tag_name, check_remotes):
+        return await self._deduplicate(
+            self._pending_lookups, (tag_name, check_remotes),
+            lambda: self._find_set(tag_name, check_remotes))
+
+    async def _find_set(self, tag_name, check_remotes):
+        local_sets = await asyncio.to_thread(self.drepo.get_local_sets)
+        for local_set in local_sets:
+            if await has_tag(local_set.path, tag_name):
+                return local_set
+
+        if check_remotes:
+            remote_sets = await asyncio.to_thread(self.drepo.get_remote_sets)
+            for remote_set in remote_sets:
+                if await has_tag(remote_set.path, tag_name):
+                    return await self.download(remote_set)
+
+        return None
+
+    async def _download(self, remote_set, dst):
+        if dst.exists():
+            raise Exception("Cannot download, the path exists already: " + str(dst))
+        await asyncio.to_thread(ensure_dir_exists, dst.parent)
+        await run_git(None, "clone", "--quiet", "--bare", str(remote_set.path), str(dst))
+        return LocalSet(dst)
+
+    async def _checkout(self, hexsha, derivation, checkout_dir, derive_on_miss):
+        tag_name = get_tag_name(hexsha, derivation)
+        local_set = await self._find_set_with_tag(tag_name, True)
+        if local_set is None and derive_on_miss:
+            local_set = await self._deduplicate(
+                self._pending_derivations, tag_name,
+                lambda: asyncio.to_thread(self.drepo.derive_on_demand, hexsha, derivation))
+        if local_set is None:
+            raise Exception("cannot find a derived version of that commit")
+        if not await asyncio.to_thread(local_set.is_valid, hexsha, derivation):
+            raise Exception("the derivation of that commit failed")
+
+        lock = self._directory_locks.setdefault(checkout_dir, asyncio.Lock())
+        async with lock, self._extraction_semaphore:
+            await asyncio.to_thread(ensure_dir_exists, checkout_dir)
+            await asyncio.to_thread(clear_directory, checkout_dir)
+            await run_git(None, "clone", "--quiet", "--no-checkout", str(local_set.path), str(checkout_dir))
+            await run_git(checkout_dir, "checkout", "--quiet", f"refs/tags/{tag_name}")
+            await asyncio.to_thread(shutil.rmtree, checkout_dir / ".git")
+        return checkout_dir
+
+    async def _deduplicate(self, pending, key, create_coroutine):
+        # Concurrent requests with the same key await the same task.
+        task = pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(create_coroutine())
+            pending[key] = task
+            task.add_done_callback(lambda _: pending.pop(key, None))
+        return await asyncio.shield(task)
+
+
+async def run_git(cwd: Optional[PathLike], *args: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        cwd=None if cwd is None else os.fspath(cwd),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"git {args[0]} failed: " + stderr.decode(errors="replace").strip())
+    return stdout
+
+async def has_tag(repo_path: Path, tag_name: str) -> bool:
+    process = await asyncio.create_subprocess_exec(
+        "git", "show-ref", "--verify", "--quiet", f"refs/tags/{tag_name}",
+        cwd=os.fspath(repo_path),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL)
+    return await process.wait() == 0
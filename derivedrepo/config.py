@@ -16,6 +16,7 @@ class ConfigFile:
 
     def __init__(self, path: Path):
         self.path = path
+        self._data = None
 
     def iter_remote_set_collections(self) -> t.Generator[RemoteFolderSetCollection, None, None]:
         data = self._load()
@@ -55,17 +56,20 @@ class ConfigFile:
         return Path(self._load()["derivePath"])
 
     def _load(self):
-        self._ensure_file_exists()
-        data = read_json_from_file(self.path)
-        data["remotes"] = data.get("remotes", [])
-        data["sourcePath"] = data.get("sourcePath", None)
-        data["derivePath"] = data.get("derivePath", None)
-        return data
+        if self._data is None:
+            self._ensure_file_exists()
+            data = read_json_from_file(self.path)
+            data["remotes"] = data.get("remotes", [])
+            data["sourcePath"] = data.get("sourcePath", None)
+            data["derivePath"] = data.get("derivePath", None)
+            self._data = data
+        return self._data
 
     def _save(self, data):
         if not self.path.parent.exists():
             os.makedirs(self.path.parent)
         write_json_to_file(self.path, data)
+        self._data = data
 
     def _ensure_file_exists(self):
         if not self.path.parent.exists():
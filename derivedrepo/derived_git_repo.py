@@ -1,19 +1,20 @@
 import os
-import git
 import json
 import shutil
 import textwrap
 import functools
 import traceback
 
+from collections import defaultdict
 from os import PathLike
 from pathlib import Path
-from typing import Any, List, Union, Optional, Callable, Tuple, Mapping, Sequence
+from typing import Any, Dict, List, Union, Optional, Callable, Tuple, Mapping, Sequence, TYPE_CHECKING
 
 from . config import ConfigFile
 from . logger import Logger
 from . worktree import WorkTree
-from . sets import LocalSet
+from . sets import LocalSet, DEFAULT_DERIVATION, get_tag_name, get_source_hexsha
+from . diff import TreeDiff, diff_tree_entries
 
 from . utils import (
     clear_directory,
@@ -26,9 +27,14 @@ from . utils import (
     write_text_file,
     exec_file,
     ensure_dir_exists,
+    file_lock,
     make_path_absolute_if_relative,
 )
 
+if TYPE_CHECKING:
+    import git
+    from . verify import SetVerification
+
 
 DeriveFunction = Callable[[Path], Union[Tuple[PathLike, Mapping[str, Any]], None]]
 
@@ -44,17 +50,16 @@ def restore_source_repo(function):
     return wrapper
 
 class DerivedGitRepo:
-    source_path: Path
-    source_repo: git.Repo
-
     local_dir: Path
     default_checkout_dir: Path
     local_sets_dir: Path
     worktrees_dir: Path
-    config: ConfigFile
+    config_path: Path
 
     derive_path: Path
-    derive: DeriveFunction
+    derive: Optional[DeriveFunction]
+    derivations: Dict[str, DeriveFunction]
+    parallel_derivations: bool
 
     @classmethod
     def init(self, source_path: PathLike, local_dir: PathLike):
@@ -74,26 +79,55 @@ class DerivedGitRepo:
         self.default_checkout_dir = self.local_dir / "checkout"
         self.worktrees_dir = self.local_dir / "worktrees"
 
-        config_path = self.local_dir / "config.json"
-        if not config_path.exists():
+        self.config_path = self.local_dir / "config.json"
+        if not self.config_path.exists():
             raise Exception("directory has no config.json")
-        self.config = ConfigFile(config_path)
-
-        self.source_path = self.config.get_source_path()
-        self.source_repo = git.Repo(self.source_path)
 
         self.derive = None
-
-    def _ensure_derive_function(self):
-        if self.derive is None:
+        self.derivations = None
+        self.parallel_derivations = False
+
+    @functools.cached_property
+    def config(self) -> ConfigFile:
+        return ConfigFile(self.config_path)
+
+    @functools.cached_property
+    def source_path(self) -> Path:
+        return self.config.get_source_path()
+
+    @functools.cached_property
+    def source_repo(self) -> "git.Repo":
+        import git
+        return git.Repo(self.source_path)
+
+    def _ensure_derivations(self):
+        if self.derivations is None and self.derive is not None:
+            # A derive function was assigned directly, derive.py is not used then.
+            self.derivations = {DEFAULT_DERIVATION : self.derive}
+        if self.derivations is None:
             values = exec_file(self.config.get_derive_path())
-            self.derive = values["derive"]
+            if "derivations" in values:
+                self.derivations = dict(values["derivations"])
+            else:
+                self.derivations = {DEFAULT_DERIVATION : values["derive"]}
+            self.parallel_derivations = values.get("parallel_derivations", False)
+
+    def _get_derive_function(self, derivation):
+        if derivation == DEFAULT_DERIVATION and self.derive is not None:
+            return self.derive
+        return self.derivations[derivation]
 
     def get_source_repo(self):
         return self.source_repo
 
+    def get_derivation_names(self):
+        self._ensure_derivations()
+        return list(self.derivations.keys())
+
     @restore_source_repo
-    def new_set(self, name: str, commits, logger=Logger()):
+    def new_set(self, name: str, commits, logger=Logger(), derivations: Optional[Sequence[str]] = None):
+        import git
+
         if isinstance(commits, (str, git.Commit)):
             commits = [commits]
 
@@ -108,15 +142,100 @@ class DerivedGitRepo:
                 raise TypeError("expected commit or commit identifier")
             final_commits.append(commit)
 
-        self._new_set(name, final_commits, logger)
+        self._new_set(name, final_commits, logger, derivations)
 
-    def checkout(self, hexsha, directory: Optional[PathLike] = None) -> Path:
-        local_set = self._try_get_any_set_with_commit(hexsha)
+    def has_derived_commit(self, hexsha, check_remotes = False, derivation = DEFAULT_DERIVATION):
+        if self._get_any_local_set_with_commit(hexsha, derivation) is not None:
+            return True
+        if check_remotes:
+            return self._get_any_remote_set_with_commit(hexsha, derivation) is not None
+        return False
+
+    def checkout(self, hexsha, directory: Optional[PathLike] = None, derivation = DEFAULT_DERIVATION,
+            derive_on_miss = False, logger=Logger()) -> Path:
+        local_set = self._try_get_any_set_with_commit(hexsha, derivation=derivation)
+        if local_set is None and derive_on_miss:
+            local_set = self.derive_on_demand(hexsha, derivation, logger)
         if local_set is None:
             raise Exception("cannot find a derived version of that commit")
+        if not local_set.is_valid(hexsha, derivation):
+            raise Exception("the derivation of that commit failed")
 
         checkout_dir = self.default_checkout_dir if directory is None else Path(directory)
-        local_set.checkout(hexsha, checkout_dir)
+        local_set.checkout(hexsha, checkout_dir, derivation)
+
+    def derive_on_demand(self, hexsha, derivation = DEFAULT_DERIVATION, logger=Logger()) -> LocalSet:
+        # Serializes all on-demand derivations, because they share the source checkout.
+        with file_lock(self.local_dir / "on-demand.lock"):
+            local_set = self._try_get_any_set_with_commit(hexsha, derivation=derivation)
+            if local_set is not None:
+                # A concurrent request derived the commit while we were waiting.
+                return local_set
+            return self._derive_into_on_demand_set(hexsha, derivation, logger)
+
+    def diff(self, old_hexsha, new_hexsha, derivation = DEFAULT_DERIVATION) -> TreeDiff:
+        old_set = self._get_set_with_commit(old_hexsha, derivation)
+        new_set = self._get_set_with_commit(new_hexsha, derivation)
+        for local_set, hexsha in ((old_set, old_hexsha), (new_set, new_hexsha)):
+            if not local_set.is_valid(hexsha, derivation):
+                raise Exception("the derivation of that commit failed: " + hexsha)
+        old_entries = old_set.get_tree_entries(old_hexsha, derivation)
+        new_entries = new_set.get_tree_entries(new_hexsha, derivation)
+        return TreeDiff(old_hexsha, new_hexsha, diff_tree_entries(old_entries, new_entries))
+
+    def diff_series(self, set_name: str) -> List[TreeDiff]:
+        local_set = self._try_get_any_set_with_name(set_name)
+        if local_set is None:
+            raise Exception("cannot find a set with that name: " + set_name)
+
+        diffs = []
+        # Failed derivations keep the tree of the previous commit, so they are skipped
+        # and every valid tag is compared to the previous valid one.
+        tag_names = [tag_name for tag_name in local_set.iter_tags_in_order()
+                     if local_set.is_tag_valid(tag_name)]
+        for old_tag_name, new_tag_name in zip(tag_names, tag_names[1:]):
+            old_entries = local_set.get_tree_entries_of_tag(old_tag_name)
+            new_entries = local_set.get_tree_entries_of_tag(new_tag_name)
+            diffs.append(TreeDiff(
+                get_source_hexsha(old_tag_name), get_source_hexsha(new_tag_name),
+                diff_tree_entries(old_entries, new_entries)))
+        return diffs
+
+    def verify(self, repair = False) -> List["SetVerification"]:
+        import concurrent.futures
+        from . verify import verify_set
+
+        self._ensure_local_sets_dir()
+        jobs = [(self.local_sets_dir / name, True) for name in os.listdir(self.local_sets_dir)
+                if (self.local_sets_dir / name).is_dir()]
+        for remote_collection in self.config.iter_remote_set_collections():
+            jobs.extend((path, False) for path in remote_collection.iter_set_paths())
+
+        # The checks run in git subprocesses, so threads are enough to use all cores.
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            results = list(executor.map(lambda job: verify_set(job[0], self.source_path, job[1]), jobs))
+
+        if repair:
+            healthy_remotes = defaultdict(list)
+            for result in results:
+                if not result.is_local and result.ok:
+                    healthy_remotes[result.name].append(result.path)
+            for i, result in enumerate(results):
+                if result.is_local and not result.ok and result.name in healthy_remotes:
+                    results[i] = self._repair_set(result, healthy_remotes[result.name])
+        return results
+
+    def _repair_set(self, result, healthy_paths):
+        from . verify import verify_set, repair_set
+
+        try:
+            repair_set(result.path, healthy_paths)
+        except Exception as e:
+            result.problems.append("repair failed: " + str(e))
+            return result
+        repaired_result = verify_set(result.path, self.source_path, True)
+        repaired_result.repaired = repaired_result.ok
+        return repaired_result
 
     def add_remote(self, path: PathLike):
         self.config.add_remote(Path(path))
@@ -129,53 +248,71 @@ class DerivedGitRepo:
         print("  Source:", self.source_path)
         print("  Local Sets:")
         for local_set in self._iter_local_sets():
-            commits = [self.source_repo.commit(hexsha) for hexsha in local_set.iter_commits()]
-            print(f"    {local_set.get_name()}: {len(commits)} commits")
+            hexshas = list(local_set.iter_commits())
+            print(f"    {local_set.get_name()}: {len(hexshas)} commits")
             if show_commits:
-                for commit in commits:
+                for commit in map(self.source_repo.commit, hexshas):
                     print(f"      {commit.hexsha[:7]} - {commit.message.splitlines()[0]}")
         print("  Remote Set Collections:")
         for set_collection in self.config.iter_remote_set_collections():
             remote_sets = list(set_collection.iter_sets())
             print(f"    Set Collection: {set_collection.get_identifier()}")
             for remote_set in remote_sets:
-                commits = [self.source_repo.commit(hexsha) for hexsha in remote_set.iter_commits()]
-                print(f"      {remote_set.get_name()}: {len(commits)} commits")
+                hexshas = list(remote_set.iter_commits())
+                print(f"      {remote_set.get_name()}: {len(hexshas)} commits")
                 if show_commits:
-                    for commit in commits:
+                    for commit in map(self.source_repo.commit, hexshas):
                         print(f"       {commit.hexsha[:7]} - {commit.message.splitlines()[0]}")
 
 
     # Set Discovery
     ##########################################
 
-    def _try_get_any_set_with_commit(self, hexsha, check_remotes = True):
-        local_set = self._get_any_local_set_with_commit(hexsha)
+    def _try_get_any_set_with_commit(self, hexsha, check_remotes = True, derivation = DEFAULT_DERIVATION):
+        local_set = self._get_any_local_set_with_commit(hexsha, derivation)
         if local_set is not None:
             return local_set
 
         if check_remotes:
-            remote_set = self._get_any_remote_set_with_commit(hexsha)
+            remote_set = self._get_any_remote_set_with_commit(hexsha, derivation)
             if remote_set is not None:
                 local_set = remote_set.download(self.local_sets_dir / remote_set.get_name())
                 return local_set
 
         return None
 
+    def _get_set_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
+        local_set = self._try_get_any_set_with_commit(hexsha, derivation=derivation)
+        if local_set is None:
+            raise Exception("cannot find a derived version of that commit: " + hexsha)
+        return local_set
+
+    def _try_get_any_set_with_name(self, name, check_remotes = True):
+        path = self.local_sets_dir / name
+        if path.is_dir():
+            return LocalSet(path)
+
+        if check_remotes:
+            for remote_set in self._iter_remote_sets():
+                if remote_set.get_name() == name:
+                    return remote_set.download(path)
+
+        return None
+
     # Local Sets
     # -----------------------------
 
     def get_local_sets(self):
         return list(self._iter_local_sets())
 
-    def _get_any_local_set_with_commit(self, hexsha):
-        for local_set in self._iter_local_sets_with_commit(hexsha):
+    def _get_any_local_set_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
+        for local_set in self._iter_local_sets_with_commit(hexsha, derivation):
             return local_set
         return None
 
-    def _iter_local_sets_with_commit(self, hexsha):
+    def _iter_local_sets_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
         for local_set in self._iter_local_sets():
-            if local_set.has_commit(hexsha):
+            if local_set.has_commit(hexsha, derivation):
                 yield local_set
 
     def _iter_local_sets(self):
@@ -192,14 +329,14 @@ class DerivedGitRepo:
     def get_remote_sets(self):
         return list(self._iter_remote_sets())
 
-    def _get_any_remote_set_with_commit(self, hexsha):
-        for remote_set in self._iter_remote_sets_with_commit(hexsha):
+    def _get_any_remote_set_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
+        for remote_set in self._iter_remote_sets_with_commit(hexsha, derivation):
             return remote_set
         return None
 
-    def _iter_remote_sets_with_commit(self, hexsha):
+    def _iter_remote_sets_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
         for remote_collection in self.config.iter_remote_set_collections():
-            for remote_set in remote_collection.iter_sets_with_commit(hexsha):
+            for remote_set in remote_collection.iter_sets_with_commit(hexsha, derivation):
                 yield remote_set
 
     def _iter_remote_sets(self):
@@ -217,49 +354,111 @@ class DerivedGitRepo:
     # Set generation
     ########################################
 
-    def _new_set(self, name, src_commits, logger):
-        worktree_dir = self.worktrees_dir / name
-        final_dir = self.local_sets_dir / name
-        if final_dir.exists():
-            raise Exception("Set exists already")
-
-        worktree = WorkTree(worktree_dir)
+    def _new_set(self, name, src_commits, logger, derivation_names):
+        self._ensure_derivations()
+        if derivation_names is None:
+            derivation_names = list(self.derivations.keys())
+        for derivation in derivation_names:
+            if derivation not in self.derivations:
+                raise Exception("derive.py has no derivation with that name: " + derivation)
+
+        final_dirs = dict()
+        for derivation in derivation_names:
+            final_dir = self.local_sets_dir / get_set_name(name, derivation)
+            if final_dir.exists():
+                raise Exception("Set exists already: " + final_dir.name)
+            final_dirs[derivation] = final_dir
+
+        worktrees = dict()
+        for derivation in derivation_names:
+            worktrees[derivation] = WorkTree(self.worktrees_dir / get_set_name(name, derivation))
 
         for src_commit in src_commits:
-            self._insert_derived_commit(worktree, src_commit, logger)
+            self._insert_derived_commit(worktrees, src_commit, logger)
+
+        for derivation, worktree in worktrees.items():
+            worktree.finalize(final_dirs[derivation])
 
-        worktree.finalize(final_dir)
+    @restore_source_repo
+    def _derive_into_on_demand_set(self, hexsha, derivation, logger):
+        self._ensure_derivations()
+        if derivation not in self.derivations:
+            raise Exception("derive.py has no derivation with that name: " + derivation)
+
+        set_name = get_set_name(on_demand_set_name, derivation)
+        worktree_dir = self.worktrees_dir / set_name
+        final_dir = self.local_sets_dir / set_name
+        if worktree_dir.exists():
+            # Left over from an interrupted run, the lock guarantees that it is unused.
+            shutil.rmtree(worktree_dir)
+
+        # A failure is not stored, otherwise it would be found and checked out from now on.
+        src_commit = self.source_repo.commit(hexsha)
+        results = self._run_derivations([derivation], src_commit, logger)
+        output_dir, custom_notes = results[derivation]
+        if output_dir is None:
+            log(logger.log_derive_failed, src_commit, custom_notes, derivation=derivation)
+            raise Exception("the derivation of that commit failed")
+
+        if final_dir.exists():
+            worktree = WorkTree(worktree_dir, final_dir)
+            self._store_derived_commit({derivation : worktree}, src_commit, results, logger)
+            worktree.update(final_dir)
+        else:
+            worktree = WorkTree(worktree_dir)
+            self._store_derived_commit({derivation : worktree}, src_commit, results, logger)
+            worktree.finalize(final_dir)
+        return LocalSet(final_dir)
 
-    def _insert_derived_commit(self, worktree, src_commit, logger):
-        self._ensure_derive_function()
+    def _insert_derived_commit(self, worktrees, src_commit, logger):
+        results = self._run_derivations(worktrees.keys(), src_commit, logger)
+        self._store_derived_commit(worktrees, src_commit, results, logger)
 
+    def _run_derivations(self, derivations, src_commit, logger):
+        # The source is checked out once and shared by all derivations.
         logger.log_checkout(src_commit)
         self.source_repo.git.checkout(src_commit.hexsha)
 
-        custom_notes = dict()
-        try:
-            logger.log_derive_start(src_commit)
-            output_dir = self.derive(self.source_path, custom_notes)
-        except:
-            traceback.print_exc()
-            output_dir = None
+        def run(derivation):
+            return self._run_derivation(derivation, src_commit, logger)
+
+        derivations = list(derivations)
+        if self.parallel_derivations and len(derivations) > 1:
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(len(derivations)) as executor:
+                return dict(zip(derivations, executor.map(run, derivations)))
+        return {derivation : run(derivation) for derivation in derivations}
 
+    def _store_derived_commit(self, worktrees, src_commit, results, logger):
         message = src_commit.summary
         author = f"{src_commit.author.name} <{src_commit.author.email}>"
         date = str(src_commit.committed_date)
-        tags = {src_commit.hexsha}
 
-        if output_dir is None:
-            logger.log_derive_failed(src_commit, custom_notes)
-            note = {"valid" : False, "data" : custom_notes}
-            worktree.commit_no_change(message, author, date, tags, note)
-        else:
-            logger.log_derive_finished(src_commit, output_dir, custom_notes)
-            note = {"valid" : True, "data" : custom_notes}
-            output_dir = Path(output_dir)
-            worktree.commit_state(output_dir, message, author, date, tags, note)
+        for derivation, worktree in worktrees.items():
+            output_dir, custom_notes = results[derivation]
+            tags = {get_tag_name(src_commit.hexsha, derivation)}
 
-        logger.log_derivative_stored(src_commit)
+            if output_dir is None:
+                log(logger.log_derive_failed, src_commit, custom_notes, derivation=derivation)
+                note = {"valid" : False, "data" : custom_notes}
+                worktree.commit_no_change(message, author, date, tags, note)
+            else:
+                log(logger.log_derive_finished, src_commit, output_dir, custom_notes, derivation=derivation)
+                note = {"valid" : True, "data" : custom_notes}
+                output_dir = Path(output_dir)
+                worktree.commit_state(output_dir, message, author, date, tags, note)
+
+            log(logger.log_derivative_stored, src_commit, derivation=derivation)
+
+    def _run_derivation(self, derivation, src_commit, logger):
+        custom_notes = dict()
+        try:
+            log(logger.log_derive_start, src_commit, derivation=derivation)
+            output_dir = self._get_derive_function(derivation)(self.source_path, custom_notes)
+        except:
+            traceback.print_exc()
+            output_dir = None
+        return output_dir, custom_notes
 
 
     # Utils
@@ -272,6 +471,20 @@ class DerivedGitRepo:
         ensure_dir_exists(self.local_sets_dir)
 
 
+def log(hook, *args, derivation):
+    # Loggers written before named derivations existed do not accept the argument.
+    if derivation == DEFAULT_DERIVATION:
+        hook(*args)
+    else:
+        hook(*args, derivation=derivation)
+
+on_demand_set_name = "on-demand"
+
+def get_set_name(name, derivation):
+    if derivation == DEFAULT_DERIVATION:
+        return name
+    return f"{name}-{derivation}"
+
 derive_file_template = textwrap.dedent('''\
     def derive(source, notes):
         return None''')
\ No newline at end of file
@@ -0,0 +1,74 @@
+import typing as t
+
+TreeEntries = t.Dict[str, t.Tuple[str, int]]
+
+class FileChange:
+    path: str
+    status: str
+    old_size: int
+    new_size: int
+
+    def __init__(self, path: str, status: str, old_size: int, new_size: int):
+        self.path = path
+        self.status = status
+        self.old_size = old_size
+        self.new_size = new_size
+
+    @property
+    def size_delta(self) -> int:
+        return self.new_size - self.old_size
+
+    def to_json(self):
+        return {
+            "path" : self.path,
+            "status" : self.status,
+            "oldSize" : self.old_size,
+            "newSize" : self.new_size,
+            "sizeDelta" : self.size_delta,
+        }
+
+class TreeDiff:
+    old_hexsha: str
+    new_hexsha: str
+    changes: t.List[FileChange]
+
+    def __init__(self, old_hexsha: str, new_hexsha: str, changes: t.List[FileChange]):
+        self.old_hexsha = old_hexsha
+        self.new_hexsha = new_hexsha
+        self.changes = changes
+
+    @property
+    def size_delta(self) -> int:
+        return sum(change.size_delta for change in self.changes)
+
+    def to_json(self):
+        return {
+            "old" : self.old_hexsha,
+            "new" : self.new_hexsha,
+            "sizeDelta" : self.size_delta,
+            "changes" : [change.to_json() for change in self.changes],
+        }
+
+def diff_tree_entries(old_entries: TreeEntries, new_entries: TreeEntries) -> t.List[FileChange]:
+    changes = []
+    for path in sorted(old_entries.keys() | new_entries.keys()):
+        old = old_entries.get(path)
+        new = new_entries.get(path)
+        if old is None:
+            changes.append(FileChange(path, "added", 0, new[1]))
+        elif new is None:
+            changes.append(FileChange(path, "removed", old[1], 0))
+        elif old[0] != new[0]:
+            changes.append(FileChange(path, "modified", old[1], new[1]))
+    return changes
+
+def parse_ls_tree(output: str) -> TreeEntries:
+    # Parses the output of `git ls-tree -r -l -z`.
+    entries = dict()
+    for line in output.split("\0"):
+        if not line:
+            continue
+        info, path = line.split("\t", 1)
+        _, _, object_hexsha, size = info.split()
+        entries[path] = (object_hexsha, 0 if size == "-" else int(size))
+    return entries
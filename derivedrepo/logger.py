@@ -1,3 +1,5 @@
+from . sets import DEFAULT_DERIVATION
+
 class Logger:
     def log_checkout(self, commit):
         pass
@@ -8,14 +10,14 @@ class Logger:
     def log_commit_already_derived(self, commit):
         pass
 
-    def log_derive_start(self, commit):
+    def log_derive_start(self, commit, derivation=DEFAULT_DERIVATION):
         pass
 
-    def log_derive_finished(self, commit, output_dir, notes):
+    def log_derive_finished(self, commit, output_dir, notes, derivation=DEFAULT_DERIVATION):
         pass
 
-    def log_derive_failed(self, commit, notes):
+    def log_derive_failed(self, commit, notes, derivation=DEFAULT_DERIVATION):
         pass
 
-    def log_derivative_stored(self, commit):
+    def log_derivative_stored(self, commit, derivation=DEFAULT_DERIVATION):
         pass
\ No newline at end of file
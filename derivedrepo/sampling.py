@@ -0,0 +1,90 @@
+import typing as t
+from collections import defaultdict
+
+if t.TYPE_CHECKING:
+    import git
+
+class SourceCommit(t.NamedTuple):
+    hexsha: str
+    timestamp: int
+    # Committer date as YYYY-MM-DD in the committer's own timezone.
+    date: str
+
+# Listing
+##########################################
+
+def list_commits(repo: "git.Repo", branch: str, *,
+        since: t.Optional[float] = None,
+        max_count: t.Optional[int] = None,
+        merges_only: bool = False) -> t.List[SourceCommit]:
+    args = ["--first-parent", rev_list_format]
+    if since is not None:
+        args.append(f"--since=@{int(since)}")
+    if max_count is not None:
+        args.append(f"--max-count={max_count}")
+    if merges_only:
+        args.append("--merges")
+    args.append(branch)
+    return parse_rev_list(repo.git.rev_list(*args))
+
+def list_commits_between(repo: "git.Repo", old: str, new: str) -> t.List[SourceCommit]:
+    # Commits strictly between old and new on the first-parent history of new.
+    commits = parse_rev_list(repo.git.rev_list("--first-parent", rev_list_format, f"{old}..{new}"))
+    return commits[:-1]
+
+def get_tagged_hexshas(repo: "git.Repo") -> t.Set[str]:
+    refs = repo.git.for_each_ref("--format=%(objectname) %(*objectname)", "refs/tags")
+    # Annotated tags have a second, peeled hexsha that points to the commit.
+    return {line.split()[-1] for line in refs.splitlines()}
+
+rev_list_format = "--format=%H %ct %cI"
+
+def parse_rev_list(output: str) -> t.List[SourceCommit]:
+    # Parses `git rev-list` output with rev_list_format and returns the commits oldest first.
+    commits = []
+    for line in output.splitlines():
+        # rev-list prints a "commit <hexsha>" header before every formatted line.
+        if line.startswith("commit "):
+            continue
+        hexsha, timestamp, iso_date = line.split()
+        commits.append(SourceCommit(hexsha, int(timestamp), iso_date[:10]))
+    commits.reverse()
+    return commits
+
+# Sampling Strategies
+##########################################
+
+# All strategies take and return commits ordered oldest first and
+# always keep the newest commit.
+
+def sample_every_nth(commits: t.List[SourceCommit], n: int) -> t.List[SourceCommit]:
+    return commits[::-1][::n][::-1]
+
+def sample_per_day(commits: t.List[SourceCommit]) -> t.List[SourceCommit]:
+    return [day_commits[-1] for day_commits in group_by_day(commits).values()]
+
+def sample_tagged(commits: t.List[SourceCommit], tagged_hexshas: t.Set[str]) -> t.List[SourceCommit]:
+    return [commit for commit in commits if commit.hexsha in tagged_hexshas]
+
+def sample_exponential(commits: t.List[SourceCommit], base: float = 2.0) -> t.List[SourceCommit]:
+    # Keeps the commits at distance 0, 1, base, base^2, ... from the newest commit.
+    if not commits:
+        return []
+    indices = {len(commits) - 1}
+    distance = 1.0
+    while distance < len(commits):
+        indices.add(len(commits) - 1 - int(distance))
+        distance *= base
+    return [commits[i] for i in sorted(indices)]
+
+def sample_evenly(commits: t.List[SourceCommit], count: int) -> t.List[SourceCommit]:
+    # Used to densify a range, so the newest commit is not special here.
+    if count >= len(commits):
+        return list(commits)
+    return [commits[(i + 1) * len(commits) // (count + 1)] for i in range(max(count, 0))]
+
+def group_by_day(commits: t.List[SourceCommit]) -> t.Dict[str, t.List[SourceCommit]]:
+    commits_per_day = defaultdict(list)
+    for commit in commits:
+        commits_per_day[commit.date].append(commit)
+    return commits_per_day
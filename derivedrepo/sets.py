@@ -1,60 +1,135 @@
 import os
-import git
+import json
 import shutil
+import functools
 from pathlib import Path
+from collections import defaultdict
 import typing as t
 
+if t.TYPE_CHECKING:
+    import git
+
+from . diff import (
+    TreeEntries,
+    parse_ls_tree,
+)
+
 from . utils import (
     clear_directory,
     ensure_dir_exists,
+    is_git_repository,
+    run_git,
 )
 
+DEFAULT_DERIVATION = "default"
+
+def get_tag_name(hexsha, derivation = DEFAULT_DERIVATION):
+    # Results of named derivations are tagged as <derivation>/<hexsha>.
+    if derivation == DEFAULT_DERIVATION:
+        return hexsha
+    return f"{derivation}/{hexsha}"
+
+def get_source_hexsha(tag_name):
+    return tag_name.rsplit("/", 1)[-1]
+
+# Tag lookups run plain git commands, so that checkout and status do not need GitPython.
+
+def has_tag(path: Path, tag_name: str):
+    return run_git(path, "show-ref", "--verify", "--quiet", f"refs/tags/{tag_name}").returncode == 0
+
+def iter_tag_names(path: Path):
+    result = run_git(path, "for-each-ref", "--format=%(refname:strip=2)", "refs/tags", check=True)
+    yield from result.stdout.decode().splitlines()
+
 class LocalSet:
     path: Path
-    repo: git.Repo
 
     def __init__(self, path: Path):
         self.path = path
-        self.repo = git.Repo(self.path)
-        assert self.repo.bare
+
+    @functools.cached_property
+    def repo(self) -> "git.Repo":
+        import git
+
+        repo = git.Repo(self.path)
+        assert repo.bare
+        return repo
 
     def get_name(self):
         return self.path.name
 
-    def has_commit(self, hexsha):
-        return hexsha in self.repo.tags
+    def has_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
+        return has_tag(self.path, get_tag_name(hexsha, derivation))
+
+    def is_valid(self, hexsha, derivation = DEFAULT_DERIVATION):
+        return self.is_tag_valid(get_tag_name(hexsha, derivation))
 
-    def checkout(self, hexsha, dst: Path):
-        real_hexsha = self.repo.tags[hexsha].commit.hexsha
+    def is_tag_valid(self, tag_name):
+        # Failed derivations are stored with a note that marks them as invalid.
+        result = run_git(self.path, "notes", "show", f"refs/tags/{tag_name}^{{commit}}")
+        if result.returncode != 0:
+            # Sets created before notes were kept have none, treat them as valid.
+            return True
+        try: note = json.loads(result.stdout)
+        except ValueError: return True
+        return not isinstance(note, dict) or note.get("valid", True) is not False
+
+    def checkout(self, hexsha, dst: Path, derivation = DEFAULT_DERIVATION):
+        tag_name = get_tag_name(hexsha, derivation)
 
         ensure_dir_exists(dst)
         clear_directory(dst)
-        temp_repo = self.repo.clone(dst, bare=False)
-        temp_repo.git.checkout(real_hexsha)
+        run_git(None, "clone", "--quiet", "--no-checkout", str(self.path), str(dst), check=True)
+        run_git(dst, "checkout", "--quiet", f"refs/tags/{tag_name}", check=True)
         shutil.rmtree(dst / ".git")
 
     def iter_commits(self):
-        yield from (tag.name for tag in self.repo.tags)
+        yield from (get_source_hexsha(tag_name) for tag_name in iter_tag_names(self.path))
+
+    def iter_tags_in_order(self):
+        # Sorted by the date of the source commit, which is the author date of the derived
+        # commit. The history is not enough, the on-demand sets grow in request order.
+        tags_per_commit = defaultdict(list)
+        refs = run_git(self.path, "for-each-ref", "--format=%(objectname) %(refname:strip=2)", "refs/tags", check=True)
+        for line in refs.stdout.decode().splitlines():
+            derived_hexsha, tag_name = line.split()
+            tags_per_commit[derived_hexsha].append(tag_name)
+        history = run_git(self.path, "log", "--reverse", "--format=%H %at", "HEAD", check=True)
+        commits = [line.split() for line in history.stdout.decode().splitlines()]
+        # The sort is stable, so commits with the same date keep their order in the history.
+        commits.sort(key=lambda commit: int(commit[1]))
+        for derived_hexsha, _ in commits:
+            yield from tags_per_commit[derived_hexsha]
+
+    def get_tree_entries(self, hexsha, derivation = DEFAULT_DERIVATION) -> TreeEntries:
+        return self.get_tree_entries_of_tag(get_tag_name(hexsha, derivation))
+
+    def get_tree_entries_of_tag(self, tag_name) -> TreeEntries:
+        result = run_git(self.path, "ls-tree", "-r", "-l", "-z", f"refs/tags/{tag_name}", check=True)
+        return parse_ls_tree(result.stdout.decode())
 
 class RemoteSet:
     def get_name(self) -> str: ...
     def get_identifier(self) -> str: ...
-    def has_commit(self, hexsha) -> bool: ...
+    def has_commit(self, hexsha, derivation = DEFAULT_DERIVATION) -> bool: ...
     def download(self, dst: Path) -> LocalSet: ...
     def iter_commits(self) -> t.Generator[str, None, None]: ...
 
 class RemoteSetCollection:
     def get_identifier(self) -> str: ...
     def iter_sets(self) -> t.Generator[RemoteSet, None, None]: ...
-    def iter_sets_with_commit(self, hexsha: str) -> t.Generator[RemoteSet, None, None]: ...
+    def iter_sets_with_commit(self, hexsha: str, derivation = DEFAULT_DERIVATION) -> t.Generator[RemoteSet, None, None]: ...
 
 class RemoteFolderSet(RemoteSet):
     path: Path
-    repo: git.Repo
 
     def __init__(self, path: Path):
         self.path = path
-        self.repo = git.Repo(self.path)
+
+    @functools.cached_property
+    def repo(self) -> "git.Repo":
+        import git
+        return git.Repo(self.path)
 
     def get_identifier(self):
         return str(self.path)
@@ -62,17 +137,17 @@ class RemoteFolderSet(RemoteSet):
     def get_name(self):
         return self.path.name
 
-    def has_commit(self, hexsha):
-        return hexsha in self.repo.tags
+    def has_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
+        return has_tag(self.path, get_tag_name(hexsha, derivation))
 
     def iter_commits(self):
-        yield from (tag.name for tag in self.repo.tags)
+        yield from (get_source_hexsha(tag_name) for tag_name in iter_tag_names(self.path))
 
     def download(self, dst: Path):
         if dst.exists():
-            raise Exception("Cannot download, the path exists already: " + dst)
+            raise Exception("Cannot download, the path exists already: " + str(dst))
         os.makedirs(dst)
-        self.repo.clone(str(dst), bare=True)
+        run_git(None, "clone", "--quiet", "--bare", str(self.path), str(dst), check=True)
         return LocalSet(dst)
 
 class RemoteFolderSetCollection(RemoteSetCollection):
@@ -85,15 +160,18 @@ class RemoteFolderSetCollection(RemoteSetCollection):
     def get_identifier(self):
         return str(self.path)
 
-    def iter_sets_with_commit(self, hexsha):
+    def iter_sets_with_commit(self, hexsha, derivation = DEFAULT_DERIVATION):
         for remote_set in self.iter_sets():
-            if remote_set.has_commit(hexsha):
+            if remote_set.has_commit(hexsha, derivation):
                 yield remote_set
 
     def iter_sets(self):
+        for repo_path in self.iter_set_paths():
+            if is_git_repository(repo_path):
+                yield RemoteFolderSet(repo_path)
+
+    def iter_set_paths(self):
         for name in os.listdir(self.path):
             repo_path = self.path / name
             if repo_path.is_dir():
-                try: remote_set = RemoteFolderSet(repo_path)
-                except: continue
-                yield remote_set
+                yield repo_path
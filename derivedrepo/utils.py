@@ -1,20 +1,24 @@
 import os
-import git
 import json
 import random
 import shutil
 import string
+import typing as t
+import contextlib
 from pathlib import Path
 
-def clear_working_dir(repo: git.Repo):
+if t.TYPE_CHECKING:
+    import git
+
+def clear_working_dir(repo: "git.Repo"):
     working_dir = Path(repo.working_dir)
     clear_directory(working_dir, {".git"})
 
-def copy_working_dir(repo: git.Repo, dst: Path):
+def copy_working_dir(repo: "git.Repo", dst: Path):
     working_dir = Path(repo.working_dir)
     copy_dir_content(working_dir, dst, {".git"})
 
-def copy_to_working_dir(src: Path, repo: git.Repo):
+def copy_to_working_dir(src: Path, repo: "git.Repo"):
     working_dir = Path(repo.working_dir)
     copy_dir_content(src, working_dir)
 
@@ -70,6 +74,59 @@ def make_path_absolute_if_relative(path: Path, default_root: Path):
     else:
         return default_root / path
 
+@contextlib.contextmanager
+def file_lock(path: Path):
+    # Exclusive lock between processes, fcntl is not available on Windows.
+    ensure_dir_exists(path.parent)
+    with open(path, "a") as fs:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            lock_windows_file(fs, msvcrt)
+            try:
+                yield
+            finally:
+                fs.seek(0)
+                msvcrt.locking(fs.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fs, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fs, fcntl.LOCK_UN)
+
+def lock_windows_file(fs, msvcrt):
+    # LK_LOCK gives up after 10 attempts, so keep trying until the lock is free.
+    while True:
+        fs.seek(0)
+        try:
+            msvcrt.locking(fs.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+def run_git(cwd: t.Optional[Path], *args: str, input: t.Optional[bytes] = None, check: bool = False):
+    import subprocess
+
+    result = subprocess.run(
+        ["git", *args],
+        cwd=None if cwd is None else os.fspath(cwd),
+        input=input,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    if check and result.returncode != 0:
+        raise Exception(f"git {args[0]} failed: " + result.stderr.decode(errors="replace").strip())
+    return result
+
+def is_git_repository(path: Path):
+    # Checks that path itself is a repository, bare or not, and not a directory inside of one.
+    result = run_git(path, "rev-parse", "--absolute-git-dir")
+    if result.returncode != 0:
+        return False
+    git_dir = Path(result.stdout.decode().strip()).resolve()
+    return git_dir in (path.resolve(), (path / ".git").resolve())
+
 def ensure_dir_exists(path: Path):
     if not path.exists():
         os.makedirs(path)
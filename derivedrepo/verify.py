@@ -0,0 +1,184 @@
+import json
+import typing as t
+from pathlib import Path
+
+from . sets import get_source_hexsha
+
+from . utils import (
+    is_git_repository,
+    run_git,
+)
+
+class SetVerification:
+    name: str
+    identifier: str
+    path: Path
+    is_local: bool
+    problems: t.List[str]
+    warnings: t.List[str]
+    repaired: bool
+
+    def __init__(self, name: str, identifier: str, path: Path, is_local: bool,
+            problems: t.List[str], warnings: t.List[str]):
+        self.name = name
+        self.identifier = identifier
+        self.path = path
+        self.is_local = is_local
+        self.problems = problems
+        self.warnings = warnings
+        self.repaired = False
+
+    @property
+    def ok(self) -> bool:
+        return len(self.problems) == 0
+
+    def to_json(self):
+        return {
+            "name" : self.name,
+            "identifier" : self.identifier,
+            "local" : self.is_local,
+            "ok" : self.ok,
+            "repaired" : self.repaired,
+            "problems" : self.problems,
+            "warnings" : self.warnings,
+        }
+
+def verify_set(path: Path, source_path: Path, is_local: bool) -> SetVerification:
+    problems, warnings = find_problems(path, source_path)
+    return SetVerification(path.name, str(path), path, is_local, problems, warnings)
+
+def find_problems(path: Path, source_path: Path) -> t.Tuple[t.List[str], t.List[str]]:
+    if not is_git_repository(path):
+        return ["not a git repository"], []
+
+    problems = []
+    warnings = []
+    problems.extend(find_connectivity_problems(path))
+
+    tags = get_tagged_commits(path)
+    if tags and not has_notes(path):
+        # Sets created before WorkTree.finalize copied the notes have none at all.
+        warnings.append("legacy set without notes, failed derivations cannot be told apart")
+    else:
+        problems.extend(find_note_problems(path, tags))
+
+    source_hexshas = [get_source_hexsha(tag_name) for tag_name in tags.keys()]
+    known_hexshas = filter_existing_commits(source_path, source_hexshas)
+    for tag_name, source_hexsha in zip(tags.keys(), source_hexshas):
+        if source_hexsha not in known_hexshas:
+            problems.append(f"tag {tag_name} does not name a commit in the source repository")
+
+    return problems, warnings
+
+def find_note_problems(path: Path, tags: t.Dict[str, str]) -> t.List[str]:
+    problems = []
+    notes = get_notes(path)
+    for tag_name, commit_hexsha in tags.items():
+        note = notes.get(commit_hexsha)
+        if note is None:
+            problems.append(f"tag {tag_name} has no note")
+            continue
+        try: data = json.loads(note)
+        except ValueError: data = None
+        if not isinstance(data, dict) or "valid" not in data:
+            problems.append(f"tag {tag_name} has an unparseable note")
+    return problems
+
+def find_connectivity_problems(path: Path) -> t.List[str]:
+    result = run_git(path, "fsck", "--connectivity-only", "--no-dangling", "--no-progress")
+    lines = (result.stdout + result.stderr).decode(errors="replace").splitlines()
+    problems = [line for line in lines if line.strip() and not line.startswith("notice:")]
+    if result.returncode != 0 and not problems:
+        problems.append("fsck failed")
+    return problems
+
+def find_missing_objects(path: Path) -> t.List[str]:
+    result = run_git(path, "fsck", "--connectivity-only", "--no-dangling", "--no-progress")
+    missing = []
+    for line in result.stdout.decode(errors="replace").splitlines():
+        # Lines look like: missing blob <hexsha>
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == "missing":
+            missing.append(parts[2])
+    return missing
+
+def get_tagged_commits(path: Path) -> t.Dict[str, str]:
+    result = run_git(path, "for-each-ref", "--format=%(refname:strip=2) %(objectname) %(*objectname)", "refs/tags")
+    tags = dict()
+    for line in result.stdout.decode().splitlines():
+        # Annotated tags have a second, peeled hexsha that points to the commit.
+        parts = line.split()
+        tags[parts[0]] = parts[-1]
+    return tags
+
+def has_notes(path: Path) -> bool:
+    return run_git(path, "show-ref", "--verify", "--quiet", "refs/notes/commits").returncode == 0
+
+def get_notes(path: Path) -> t.Dict[str, str]:
+    result = run_git(path, "notes", "list")
+    note_per_commit = dict()
+    for line in result.stdout.decode().splitlines():
+        note_hexsha, commit_hexsha = line.split()
+        note_per_commit[commit_hexsha] = note_hexsha
+
+    contents = read_blobs(path, note_per_commit.values())
+    return {commit_hexsha : contents.get(note_hexsha)
+            for commit_hexsha, note_hexsha in note_per_commit.items()
+            if contents.get(note_hexsha) is not None}
+
+def read_blobs(path: Path, hexshas: t.Iterable[str]) -> t.Dict[str, str]:
+    hexshas = list(hexshas)
+    if not hexshas:
+        return dict()
+    result = run_git(path, "cat-file", "--batch", input="".join(h + "\n" for h in hexshas).encode())
+    output = result.stdout
+    contents = dict()
+    position = 0
+    for hexsha in hexshas:
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].decode().split()
+        position = header_end + 1
+        if len(header) < 3:
+            # The object is missing.
+            continue
+        size = int(header[2])
+        contents[hexsha] = output[position:position + size].decode(errors="replace")
+        position += size + 1
+    return contents
+
+def filter_existing_commits(repo_path: Path, hexshas: t.List[str]) -> t.Set[str]:
+    if not hexshas:
+        return set()
+    result = run_git(repo_path, "cat-file", "--batch-check=%(objectname) %(objecttype)",
+                     input="".join(h + "\n" for h in hexshas).encode())
+    existing = set()
+    for line in result.stdout.decode().splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == "commit":
+            existing.add(parts[0])
+    return existing
+
+def repair_set(path: Path, candidate_paths: t.List[Path]):
+    # Copies only the objects that fsck reports as missing and leaves the refs alone,
+    # a copy with the same name may be behind or ahead. Restored trees can reveal
+    # further missing objects, so repeat until nothing changes.
+    previous_missing = None
+    while True:
+        missing = find_missing_objects(path)
+        if not missing or missing == previous_missing:
+            break
+        healthy_path = next((candidate_path for candidate_path in candidate_paths
+                             if has_all_objects(candidate_path, missing)), None)
+        if healthy_path is None:
+            raise Exception("no remote copy contains the missing objects")
+        pack = run_git(healthy_path, "pack-objects", "--stdout",
+                       input="".join(h + "\n" for h in missing).encode(), check=True).stdout
+        run_git(path, "unpack-objects", "-q", input=pack, check=True)
+        previous_missing = missing
+
+def has_all_objects(path: Path, hexshas: t.List[str]) -> bool:
+    result = run_git(path, "cat-file", "--batch-check=%(objectname)",
+                     input="".join(h + "\n" for h in hexshas).encode())
+    # Missing objects are reported as "<hexsha> missing".
+    return result.returncode == 0 and not any(
+        line.endswith(" missing") for line in result.stdout.decode().splitlines())
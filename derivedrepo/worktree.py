@@ -1,11 +1,13 @@
 import os
-import git
 import json
 import shutil
 import typing as t
 
 from pathlib import Path
 
+if t.TYPE_CHECKING:
+    import git
+
 from . utils import (
     ensure_dir_exists,
     clear_working_dir,
@@ -14,15 +16,23 @@ from . utils import (
 
 class WorkTree:
     path: Path
-    repo: git.Repo
+    repo: "git.Repo"
+
+    def __init__(self, path: Path, set_path: t.Optional[Path] = None):
+        import git
 
-    def __init__(self, path: Path):
         if path.exists():
             raise Exception("directory exists already:", path)
 
-        os.makedirs(path)
         self.path = path
-        self.repo = git.Repo.init(path)
+        if set_path is None:
+            os.makedirs(path)
+            self.repo = git.Repo.init(path)
+        else:
+            # Continue the history of an existing set.
+            self.repo = git.Repo.clone_from(str(set_path), str(path))
+            try: self.repo.git.fetch("origin", "refs/notes/commits:refs/notes/commits")
+            except git.GitCommandError: pass
 
     def commit_state(self,
             source: Path,
@@ -52,6 +62,16 @@ class WorkTree:
         self.repo.git.notes("add", "-m", json.dumps(custom_notes))
 
     def finalize(self, dst: Path):
+        import git
+
         repo = git.Repo.clone_from(str(self.path), str(dst), bare=True)
+        # Notes are not copied by clone. Sets finalized before this was added have no notes,
+        # verify reports them as legacy sets.
+        if self.repo.git.notes("list"):
+            repo.git.fetch(str(self.path.resolve()), "refs/notes/commits:refs/notes/commits")
         shutil.rmtree(self.path)
-        return repo
\ No newline at end of file
+        return repo
+
+    def update(self, dst: Path):
+        self.repo.git.push(str(dst.resolve()), "HEAD", "refs/notes/commits", "--tags")
+        shutil.rmtree(self.path)
\ No newline at end of file
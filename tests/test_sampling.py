@@ -0,0 +1,87 @@
+import os
+import subprocess
+
+import pytest
+
+from derivedrepo import sampling
+from derivedrepo.sampling import SourceCommit
+
+
+def make_commits(amount):
+    return [SourceCommit(f"{i:040x}", 1000 + i, "2026-01-01") for i in range(amount)]
+
+
+@pytest.fixture
+def repo(tmp_path):
+    git = pytest.importorskip("git")
+
+    def run(*args, date=None):
+        env = dict(os.environ)
+        if date is not None:
+            env.update(GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+        subprocess.run(["git", *args], cwd=tmp_path, env=env, capture_output=True, check=True)
+
+    run("init", "--quiet")
+    run("config", "user.name", "Test")
+    run("config", "user.email", "test@example.com")
+    for i in range(6):
+        (tmp_path / "file").write_text(str(i))
+        run("add", "file")
+        run("commit", "--quiet", "-m", f"c{i}", date=f"2026-01-{i + 1:02} 12:00:00 +0000")
+    return git.Repo(tmp_path)
+
+
+@pytest.mark.parametrize("amount, n, expected", [
+    (0, 3, []),
+    (1, 3, [0]),
+    (7, 3, [0, 3, 6]),
+    (8, 3, [1, 4, 7]),
+    (4, 10, [3]),
+])
+def test_sample_every_nth(amount, n, expected):
+    commits = make_commits(amount)
+    assert sampling.sample_every_nth(commits, n) == [commits[i] for i in expected]
+
+
+@pytest.mark.parametrize("amount, base, expected", [
+    (0, 2.0, []),
+    (1, 2.0, [0]),
+    (10, 2.0, [1, 5, 7, 8, 9]),
+    (10, 3.0, [0, 6, 8, 9]),
+])
+def test_sample_exponential(amount, base, expected):
+    commits = make_commits(amount)
+    assert sampling.sample_exponential(commits, base) == [commits[i] for i in expected]
+
+
+@pytest.mark.parametrize("amount, count, expected", [
+    (0, 3, []),
+    (3, 3, [0, 1, 2]),
+    (3, 5, [0, 1, 2]),
+    (10, 1, [5]),
+    (10, 4, [2, 4, 6, 8]),
+    (10, 0, []),
+])
+def test_sample_evenly(amount, count, expected):
+    commits = make_commits(amount)
+    assert sampling.sample_evenly(commits, count) == [commits[i] for i in expected]
+
+
+def test_sample_evenly_returns_a_copy():
+    commits = make_commits(3)
+    assert sampling.sample_evenly(commits, 5) is not commits
+
+
+def test_list_commits_between(repo):
+    commits = sampling.list_commits_between(repo, "HEAD~4", "HEAD")
+    messages = [repo.commit(commit.hexsha).summary for commit in commits]
+    assert messages == ["c2", "c3", "c4"]
+    assert [commit.date for commit in commits] == ["2026-01-03", "2026-01-04", "2026-01-05"]
+
+
+def test_list_commits_between_neighbours(repo):
+    assert sampling.list_commits_between(repo, "HEAD~1", "HEAD") == []
+
+
+def test_list_commits_between_old_not_an_ancestor(repo):
+    assert sampling.list_commits_between(repo, "HEAD", "HEAD~3") == []
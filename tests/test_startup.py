@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that only specific commands need. Loading them at startup slows
+# down every invocation.
+DEFERRED_MODULES = ["git", "asyncio", "subprocess", "concurrent.futures"]
+
+IMPORT_BUDGET = 0.15
+# Relative to a bare `import click`, so that the budget holds on slower machines.
+# Measured at about 1.4, importing GitPython at startup pushes it to about 2.5.
+CLI_BUDGET_RATIO = 2.0
+
+
+def run_python(code, cwd=ROOT):
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    # Commands may print before the result, which is always the last line.
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def best_of(runs, function):
+    return min(function() for _ in range(runs))
+
+
+def test_import_loads_no_deferred_modules():
+    loaded = run_python(
+        "import json, sys, derivedrepo\n"
+        f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))")
+    assert loaded == []
+
+
+def test_import_time_budget():
+    def measure():
+        return run_python(
+            "import json, time\n"
+            "start = time.perf_counter()\n"
+            "import derivedrepo\n"
+            "print(json.dumps(time.perf_counter() - start))")
+    assert best_of(3, measure) < IMPORT_BUDGET
+
+
+@pytest.mark.parametrize("args", [["remote", "list"], ["status"]])
+def test_cli_does_not_load_git(tmp_path, args):
+    (tmp_path / "config.json").write_text(json.dumps({"sourcePath" : str(tmp_path)}))
+    loaded = run_python(
+        "import json, sys, cli\n"
+        f"cli.cli.main({args!r}, standalone_mode=False)\n"
+        f"print(json.dumps([m for m in ['git'] if m in sys.modules]))",
+        cwd=tmp_path)
+    assert loaded == []
+
+
+def test_cli_startup_budget(tmp_path):
+    (tmp_path / "config.json").write_text(json.dumps({"sourcePath" : str(tmp_path)}))
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+
+    def measure(*args):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            cwd=tmp_path, env=env, capture_output=True, check=True)
+        return time.perf_counter() - start
+    click_time = best_of(5, lambda: measure("-c", "import click"))
+    cli_time = best_of(5, lambda: measure(str(ROOT / "cli.py"), "remote", "list"))
+    assert cli_time < CLI_BUDGET_RATIO * click_time